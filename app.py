@@ -1,45 +1,287 @@
 import os
 import pandas as pd
+import numpy as np
 import tempfile
 import gc  # For garbage collection
 import time  # For adding delays
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session
+import shutil
+import multiprocessing
+import gzip
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import Counter
+from collections import deque
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session, Response, stream_with_context
 from werkzeug.utils import secure_filename
+import openpyxl
 import langchain
 from langchain_groq import ChatGroq
 from langchain.prompts import PromptTemplate
 import requests
 import json
+import re
 import uuid
+import socket
 from dotenv import load_dotenv
 
+try:
+    import psutil
+except ImportError:  # Memory tracking is optional; the scheduler falls back to fixed settings
+    psutil = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet output is only offered when pyarrow is installed
+    pyarrow = None
+
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
-app.config['UPLOAD_FOLDER'] = 'uploads'
+# A shared SECRET_KEY keeps sessions valid across gunicorn workers and nodes
+app.secret_key = os.getenv('SECRET_KEY')
+if not app.secret_key:
+    if int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+        # A per-process key would break sessions and flash messages between workers
+        raise RuntimeError("SECRET_KEY must be set when WEB_CONCURRENCY is greater than 1")
+    app.secret_key = os.urandom(24)
+# Point UPLOAD_FOLDER at a shared volume when running more than one worker or node
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
 app.config['ALLOWED_EXTENSIONS'] = {'csv', 'xls', 'xlsx'}
 app.config['SESSION_TYPE'] = 'filesystem'
-app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # Limit upload size to 5MB
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', 200)) * 1024 * 1024  # CSV uploads are parsed as a stream
+
+# Bulk processing memory budget - the scheduler adapts batch size and concurrency to stay under it
+app.config['MEMORY_BUDGET_MB'] = int(os.getenv('MEMORY_BUDGET_MB', 400))
+app.config['MAX_BATCH_SIZE'] = int(os.getenv('MAX_BATCH_SIZE', 50))
+app.config['MAX_CONCURRENCY'] = int(os.getenv('MAX_CONCURRENCY', 8))
+
+# Sharded bulk processing - shards live in a job store any worker process or node can pull from
+app.config['JOB_STORE_DIR'] = os.getenv('JOB_STORE_DIR', os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'))
+app.config['SHARD_SIZE'] = int(os.getenv('SHARD_SIZE', 200))  # Rows per shard
+app.config['SHARD_WORKERS'] = int(os.getenv('SHARD_WORKERS', 1))  # Local processes per upload
+app.config['SHARD_CLAIM_TIMEOUT'] = int(os.getenv('SHARD_CLAIM_TIMEOUT', 600))  # Seconds before a stuck shard is retried
+app.config['SHARD_POLL_INTERVAL'] = float(os.getenv('SHARD_POLL_INTERVAL', 1))
+
+# Bulk result formats: extension and download mimetype
+OUTPUT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'jsonl': ('.jsonl', 'application/x-ndjson'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'xlsx': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+}
+
+# Near-duplicate detection across generated variants
+app.config['DEDUP_ENABLED'] = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+app.config['DEDUP_THRESHOLD'] = float(os.getenv('DEDUP_THRESHOLD', 0.7))  # Estimated Jaccard similarity
+app.config['DEDUP_ROUNDS'] = int(os.getenv('DEDUP_ROUNDS', 2))  # Regeneration passes over flagged cells
+app.config['DEDUP_MAX_ROWS'] = int(os.getenv('DEDUP_MAX_ROWS', 100000))  # Larger results skip the stage
+
+# Async API jobs - the owning process refreshes a heartbeat; jobs whose owner goes quiet are reported as failed
+app.config['API_JOB_HEARTBEAT'] = float(os.getenv('API_JOB_HEARTBEAT', 10))  # Seconds between heartbeats
+app.config['API_JOB_STALE_AFTER'] = float(os.getenv('API_JOB_STALE_AFTER', 120))  # Seconds without one before failing
 
 # API Keys
 PERPLEXITY_API_KEY = os.getenv('PERPLEXITY_API_KEY')
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 
-# Initialize Groq LLM
-groq_llm = ChatGroq(
-    api_key=GROQ_API_KEY,
-    model_name="llama3-70b-8192"
-)
+# LLM routing - the first model in LLM_MODELS is primary, the second receives hedged requests
+app.config['LLM_MODELS'] = [m.strip() for m in os.getenv('LLM_MODELS', 'llama3-70b-8192').split(',') if m.strip()]
+app.config['HEDGE_DELAY'] = float(os.getenv('HEDGE_DELAY', 5))  # Seconds, until enough latencies are observed
+app.config['HEDGE_MIN_SAMPLES'] = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+
+def models_from_env(name):
+    """Comma-separated model list from an environment variable, defaulting to LLM_MODELS"""
+    models = [m.strip() for m in os.getenv(name, '').split(',') if m.strip()]
+    return models or app.config['LLM_MODELS']
+
+# Meta description drafting: 'sequential' drafts once and re-prompts to fix the length,
+# 'parallel' requests several length-bounded candidates at once and picks the best locally
+app.config['META_CANDIDATE_MODE'] = os.getenv('META_CANDIDATE_MODE', 'sequential')
+app.config['META_CANDIDATES'] = int(os.getenv('META_CANDIDATES', 3))
+app.config['META_CANDIDATE_MAX_TOKENS'] = int(os.getenv('META_CANDIDATE_MAX_TOKENS', 80))
+
+# Provider scheduling - interactive requests are served before bulk work, which shares what is left per job
+app.config['PROVIDER_CONCURRENCY'] = int(os.getenv('PROVIDER_CONCURRENCY', 8))  # Concurrent LLM calls per process
+app.config['INTERACTIVE_RESERVED_SLOTS'] = int(os.getenv('INTERACTIVE_RESERVED_SLOTS', 2))  # Never used by bulk work
+app.config['BULK_MAX_PAUSE'] = float(os.getenv('BULK_MAX_PAUSE', 30))  # Longest a bulk row waits on interactive traffic
+
+# Deadlines - each interactive request and each bulk row gets an end-to-end budget that every stage consults
+app.config['REQUEST_DEADLINE'] = float(os.getenv('REQUEST_DEADLINE', 45))  # Seconds per single-entry request
+app.config['BULK_ROW_DEADLINE'] = float(os.getenv('BULK_ROW_DEADLINE', 90))  # Seconds per bulk row
+app.config['GENERATION_RESERVE'] = float(os.getenv('GENERATION_RESERVE', 10))  # Budget research must leave for the LLM
+app.config['ADJUST_MIN_BUDGET'] = float(os.getenv('ADJUST_MIN_BUDGET', 5))  # Skip length rewrites below this
+
+# Shard claims are refreshed as each row completes, so a row must finish well within the claim timeout
+if app.config['SHARD_CLAIM_TIMEOUT'] <= 2 * app.config['BULK_ROW_DEADLINE']:
+    app.logger.warning("SHARD_CLAIM_TIMEOUT (%ss) should exceed twice BULK_ROW_DEADLINE (%ss), "
+                       "or shards still being processed may be retried",
+                       app.config['SHARD_CLAIM_TIMEOUT'], app.config['BULK_ROW_DEADLINE'])
+
+# Per-task model tiers: first drafts, length-adjust rewrites and CTAs can each use their own models
+app.config['MODEL_TIERS'] = {
+    'draft': models_from_env('DRAFT_MODELS'),
+    'adjust': models_from_env('ADJUST_MODELS'),
+    'cta': models_from_env('CTA_MODELS')
+}
 
 # Helper functions
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def get_rss_mb():
+    """Return the resident memory of this process in MB, or None if psutil is unavailable"""
+    if psutil is None:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+
+class MemoryBudgetScheduler:
+    """Adapt bulk batch size and concurrency to keep RSS within a memory budget"""
+    
+    # Fractions of the budget that trigger shrinking (high) or growing (low)
+    HIGH_WATER = 0.85
+    LOW_WATER = 0.6
+    
+    def __init__(self, budget_mb, max_batch_size=50, max_concurrency=8):
+        self.budget_mb = budget_mb
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        # Start conservatively and grow once we know there is headroom
+        self.batch_size = min(3, self.max_batch_size)
+        self.concurrency = 1
+        self.collections = 0
+    
+    def usage(self):
+        """Fraction of the memory budget currently in use, or None if unknown"""
+        rss = get_rss_mb()
+        if rss is None or self.budget_mb <= 0:
+            return None
+        return rss / self.budget_mb
+    
+    def after_batch(self):
+        """Re-tune batch size and concurrency after a batch, collecting only when over budget"""
+        usage = self.usage()
+        if usage is None:
+            # Without memory readings keep the conservative defaults
+            return
+        
+        if usage >= self.HIGH_WATER:
+            gc.collect()
+            self.collections += 1
+            usage = self.usage()
+            if usage >= self.HIGH_WATER:
+                self.batch_size = max(1, self.batch_size // 2)
+                self.concurrency = max(1, self.concurrency // 2)
+        elif usage < self.LOW_WATER:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+    
+    def stats(self):
+        return {
+            'batch_size': self.batch_size,
+            'concurrency': self.concurrency,
+            'collections': self.collections,
+            'budget_mb': self.budget_mb
+        }
+
+class CircuitBreaker:
+    """Fail fast on a dependency after consecutive failures, probing periodically to recover
+    
+    closed: requests flow normally. open: requests are refused until reset_timeout
+    has passed. half_open: a single probe request is let through; its outcome
+    closes or re-opens the circuit.
+    """
+    
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.trips = 0
+        self.lock = threading.Lock()
+    
+    def allow_request(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.time()
+            self.probe_in_flight = False
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'trips': self.trips,
+                'retry_in': (max(0, round(self.reset_timeout - (time.time() - self.opened_at), 1))
+                             if self.state == 'open' else None)
+            }
+
+perplexity_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('PERPLEXITY_BREAKER_THRESHOLD', 3)),
+    reset_timeout=float(os.getenv('PERPLEXITY_BREAKER_RESET', 30))
+)
+
+# End-to-end deadline (epoch seconds) of the work running in the current context
+request_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage cannot finish within the current deadline"""
+
+@contextmanager
+def deadline_context(seconds):
+    """Give work in this context a deadline, never extending an enclosing one"""
+    deadline = time.time() + seconds
+    current = request_deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+def remaining_budget():
+    """Seconds left before the current deadline, or None when there is no deadline"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.time())
+
 def search_perplexity(title, keyword):
-    """Search using Perplexity API for additional context with retry logic"""
+    """Search using Perplexity API for additional context with retry logic
+    
+    Serves the fallback context immediately while the circuit breaker is open, or
+    when the remaining deadline budget is needed for generation.
+    """
+    fallback = f"Using keyword '{keyword}' for SEO optimization."
     headers = {
         "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
         "Content-Type": "application/json"
@@ -56,106 +298,659 @@ def search_perplexity(title, keyword):
     retry_delay = 2  # seconds
     
     for attempt in range(max_retries):
+        # Research is optional: only spend budget the LLM will not need
+        timeout = 10  # Add timeout to prevent hanging
+        budget = remaining_budget()
+        if budget is not None:
+            timeout = min(timeout, budget - app.config['GENERATION_RESERVE'])
+            if timeout < 1:
+                return fallback
+        
+        if not perplexity_breaker.allow_request():
+            return fallback
+        
         try:
             response = requests.post(
                 "https://api.perplexity.ai/chat/completions",
                 headers=headers,
                 data=json.dumps(data),
-                timeout=10  # Add timeout to prevent hanging
+                timeout=timeout
             )
             
             if response.status_code == 200:
-                return response.json()['choices'][0]['message']['content']
-            elif response.status_code == 429:  # Rate limit
-                if attempt < max_retries - 1:  # Don't sleep on the last attempt
-                    time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
-                    continue
-            else:
-                return f"Using keyword '{keyword}' for SEO optimization."  # Fallback content
+                content = response.json()['choices'][0]['message']['content']
+                perplexity_breaker.record_success()
+                return content
+            
+            perplexity_breaker.record_failure()
+            if response.status_code != 429:  # Only rate limits are worth retrying
+                return fallback
         except Exception as e:
-            if attempt < max_retries - 1:  # Don't sleep on the last attempt
-                time.sleep(retry_delay * (attempt + 1))
-                continue
-            return f"Using keyword '{keyword}' for SEO optimization."  # Fallback content
+            perplexity_breaker.record_failure()
+        
+        if attempt < max_retries - 1:  # Don't sleep on the last attempt
+            if perplexity_breaker.stats()['state'] == 'open':
+                return fallback  # No point waiting out a backoff for a tripped circuit
+            budget = remaining_budget()
+            if budget is not None and budget - retry_delay * (attempt + 1) < app.config['GENERATION_RESERVE'] + 1:
+                return fallback  # The backoff would eat into the generation budget
+            time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
     
-    return f"Using keyword '{keyword}' for SEO optimization."  # Final fallback
+    return fallback  # Final fallback
 
-def generate_meta_description(title, keyword, target_length=150, style=None):
-    """Generate meta description using LLM with character count validation"""
-    if style is None:
-        style = {
-            'desc': 'compelling',
-            'approach': 'Focus on benefits and unique value'
+# Priority of the work running in the current context, and the bulk job it belongs to
+request_priority = contextvars.ContextVar('request_priority', default='interactive')
+request_job = contextvars.ContextVar('request_job', default=None)
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """Submit to an executor so the task sees the caller's priority and job"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+@contextmanager
+def bulk_context(job_id):
+    """Mark work in this context as bulk work belonging to job_id"""
+    priority_token = request_priority.set('bulk')
+    job_token = request_job.set(job_id)
+    try:
+        yield
+    finally:
+        request_job.reset(job_token)
+        request_priority.reset(priority_token)
+
+class SlotUnavailable(Exception):
+    """Raised by a non-blocking slot request when no slot can be granted immediately"""
+
+class PriorityScheduler:
+    """Share provider call slots between interactive requests and bulk jobs
+    
+    Interactive calls are granted a free slot before any waiting bulk call, and
+    reserved_interactive slots are never given to bulk work. Waiting bulk calls
+    are granted to the job holding the fewest slots, then the job served least
+    while it has been active, so concurrent jobs share fairly. Bulk rows also pause at row boundaries (bulk_checkpoint) while an
+    interactive request is in progress.
+    """
+    
+    def __init__(self, slots=8, reserved_interactive=2, max_bulk_pause=30):
+        self.slots = max(1, slots)
+        self.reserved_interactive = min(max(0, reserved_interactive), self.slots - 1)
+        self.max_bulk_pause = max_bulk_pause
+        self.cond = threading.Condition()
+        self.in_use = 0
+        self.held_by_job = Counter()
+        self.served_by_job = Counter()
+        self.waiting = []  # [ticket, priority, job_id], oldest first
+        self.next_ticket = 0
+        self.active_interactive = 0
+        self.preemptions = 0
+    
+    def _can_grant(self, waiter):
+        ticket, priority, job_id = waiter
+        if priority == 'interactive':
+            first = next(w for w in self.waiting if w[1] == 'interactive')
+            return first is waiter and self.in_use < self.slots
+        
+        if any(w[1] == 'interactive' for w in self.waiting):
+            return False
+        if self.in_use >= self.slots - self.reserved_interactive:
+            return False
+        bulk_waiters = [w for w in self.waiting if w[1] == 'bulk']
+        return min(bulk_waiters, key=lambda w: (self.held_by_job[w[2]], self.served_by_job[w[2]], w[0])) is waiter
+    
+    @contextmanager
+    def slot(self, blocking=True):
+        """Hold a provider call slot for the current context's priority and job
+        
+        With blocking=False, raise SlotUnavailable instead of queueing.
+        """
+        priority = request_priority.get()
+        job_id = request_job.get()
+        with self.cond:
+            waiter = [self.next_ticket, priority, job_id]
+            self.next_ticket += 1
+            self.waiting.append(waiter)
+            if blocking:
+                granted = self.cond.wait_for(lambda: self._can_grant(waiter), timeout=remaining_budget())
+            else:
+                granted = self._can_grant(waiter)
+            self.waiting.remove(waiter)
+            if not granted:
+                self.cond.notify_all()
+                if not blocking:
+                    raise SlotUnavailable("no provider slot is free")
+                raise DeadlineExceeded("deadline passed while waiting for a provider slot")
+            self.in_use += 1
+            if priority == 'bulk':
+                self.held_by_job[job_id] += 1
+                self.served_by_job[job_id] += 1
+            self.cond.notify_all()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.in_use -= 1
+                if priority == 'bulk':
+                    self.held_by_job[job_id] -= 1
+                    if not self.held_by_job[job_id]:
+                        del self.held_by_job[job_id]
+                        # Forget a job's usage once it has nothing in flight or queued
+                        if not any(w[2] == job_id for w in self.waiting):
+                            del self.served_by_job[job_id]
+                self.cond.notify_all()
+    
+    @contextmanager
+    def interactive(self):
+        """Mark an interactive request as in progress so bulk rows yield to it"""
+        with self.cond:
+            self.active_interactive += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.active_interactive -= 1
+                self.cond.notify_all()
+    
+    def bulk_checkpoint(self):
+        """Row boundary for bulk work: wait while interactive requests are in progress"""
+        if request_priority.get() != 'bulk':
+            return
+        with self.cond:
+            if self.active_interactive:
+                self.preemptions += 1
+                # Bounded so a steady stream of interactive traffic cannot starve bulk jobs
+                timeout = self.max_bulk_pause
+                budget = remaining_budget()
+                if budget is not None:
+                    timeout = min(timeout, budget)
+                self.cond.wait_for(lambda: not self.active_interactive, timeout=timeout)
+    
+    def stats(self):
+        with self.cond:
+            return {
+                'slots': self.slots,
+                'in_use': self.in_use,
+                'waiting_interactive': sum(1 for w in self.waiting if w[1] == 'interactive'),
+                'waiting_bulk': sum(1 for w in self.waiting if w[1] == 'bulk'),
+                'active_interactive': self.active_interactive,
+                'bulk_jobs': len(self.held_by_job),
+                'preemptions': self.preemptions
+            }
+
+llm_scheduler = PriorityScheduler(
+    slots=app.config['PROVIDER_CONCURRENCY'],
+    reserved_interactive=app.config['INTERACTIVE_RESERVED_SLOTS'],
+    max_bulk_pause=app.config['BULK_MAX_PAUSE']
+)
+
+def token_usage(response):
+    """(input, output) token counts reported with an LLM response, or zeros if unavailable"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage:
+        return usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+    metadata = getattr(response, 'response_metadata', None) or {}
+    usage = metadata.get('token_usage') or {}
+    return usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+
+class ModelBackend:
+    """A registered LLM backend with a rolling window of observed latencies"""
+    
+    def __init__(self, name, llm, window=200):
+        self.name = name
+        self.llm = llm
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.lock = threading.Lock()
+    
+    def invoke(self, prompt, started=None, blocking=True, **kwargs):
+        """Call the model within a provider slot
+        
+        started, if given, is an Event set once the slot is granted (or the request
+        for one fails); blocking=False raises SlotUnavailable rather than queueing.
+        """
+        try:
+            with llm_scheduler.slot(blocking):
+                if started:
+                    started.set()
+                # Latency excludes time spent queued for a slot
+                start = time.time()
+                try:
+                    response = self.llm.invoke(prompt, **kwargs)
+                except Exception:
+                    with self.lock:
+                        self.calls += 1
+                        self.errors += 1
+                    raise
+                elapsed = time.time() - start
+        finally:
+            if started:
+                started.set()
+        input_tokens, output_tokens = token_usage(response)
+        with self.lock:
+            self.calls += 1
+            self.latencies.append(elapsed)
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+        return response
+    
+    def percentile(self, fraction, min_samples=1):
+        """Observed latency percentile in seconds, or None with too few samples"""
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[int(fraction * (len(samples) - 1))]
+    
+    def stats(self):
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'p50_seconds': round(p50, 3) if p50 is not None else None,
+            'p95_seconds': round(p95, 3) if p95 is not None else None
+        }
+
+class ModelRouter:
+    """Route prompts to registered LLM backends, hedging slow primary calls
+    
+    The first registered backend is primary. When it has not answered within its
+    observed p95 latency (or hedge_delay before enough samples exist), the same
+    prompt is sent to the second backend and the first valid answer wins. The
+    hedge clock starts once the primary holds a provider slot, so local queueing
+    never triggers a hedge, and a hedge is only sent if a slot is free right away.
+    A primary that fails outright falls over to the secondary.
+    
+    Interactive and bulk calls run on separate executors so interactive calls
+    never queue behind bulk work for a thread.
+    """
+    
+    def __init__(self, hedge_delay=5.0, min_samples=20, max_workers=32):
+        self.backends = []
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.executors = {
+            'interactive': ThreadPoolExecutor(max_workers=max_workers),
+            'bulk': ThreadPoolExecutor(max_workers=max_workers)
+        }
+        self.hedges = 0
+        self.hedges_skipped = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+    
+    def register(self, name, llm):
+        backend = ModelBackend(name, llm)
+        self.backends.append(backend)
+        return backend
+    
+    def hedge_after(self):
+        """Seconds to wait on the primary before sending a hedged request"""
+        p95 = self.backends[0].percentile(0.95, self.min_samples)
+        return p95 if p95 is not None else self.hedge_delay
+    
+    def invoke(self, prompt, **kwargs):
+        """Invoke the backends with a prompt; kwargs are passed through as generation settings
+        
+        Raises DeadlineExceeded if no answer arrives before the current deadline.
+        """
+        primary = self.backends[0]
+        can_hedge = len(self.backends) > 1
+        if not can_hedge and remaining_budget() is None:
+            return primary.invoke(prompt, **kwargs)
+        secondary = self.backends[1] if can_hedge else None
+        executor = self.executors[request_priority.get()]
+        
+        started = threading.Event()
+        owners = {submit_in_context(executor, primary.invoke, prompt, started=started, **kwargs): primary}
+        if can_hedge:
+            # Time queued for a local slot is not provider latency, so the hedge clock starts at the grant
+            started.wait(remaining_budget())
+        timeout = self.hedge_after() if can_hedge else None
+        budget = remaining_budget()
+        if budget is not None:
+            timeout = budget if timeout is None else min(timeout, budget)
+        done, pending = wait(owners, timeout=timeout)
+        if not done and can_hedge and remaining_budget() != 0:
+            owners[submit_in_context(executor, secondary.invoke, prompt, blocking=False, **kwargs)] = secondary
+            pending = set(owners)
+            with self.lock:
+                self.hedges += 1
+        
+        errors = []
+        empty_response = None
+        while pending or done:
+            for future in done:
+                try:
+                    response = future.result()
+                except SlotUnavailable:
+                    # No free slot for the hedge; keep waiting on the primary alone
+                    del owners[future]
+                    with self.lock:
+                        self.hedges -= 1
+                        self.hedges_skipped += 1
+                    continue
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if not response.content.strip():
+                    # Only worth rejecting while another backend may still answer
+                    empty_response = empty_response or response
+                    continue
+                
+                # Queued losers never start; a running loser finishes in the background and is ignored
+                for loser in pending:
+                    loser.cancel()
+                if owners[future] is not primary:
+                    with self.lock:
+                        self.hedge_wins += 1
+                return response
+            
+            if not pending and len(owners) == 1 and can_hedge:
+                # The primary failed before the hedge fired, so fail over
+                hedge = submit_in_context(executor, secondary.invoke, prompt, **kwargs)
+                owners[hedge] = secondary
+                pending = {hedge}
+            
+            if not pending:
+                break
+            done, pending = wait(pending, timeout=remaining_budget(), return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise DeadlineExceeded("deadline passed waiting for the model")
+        
+        if empty_response is not None:
+            # Callers already repair empty or short output
+            return empty_response
+        raise errors[-1]
+    
+    def stats(self):
+        return {
+            'hedge_after_seconds': round(self.hedge_after(), 3),
+            'hedges': self.hedges,
+            'hedges_skipped': self.hedges_skipped,
+            'hedge_wins': self.hedge_wins,
+            'backends': {backend.name: backend.stats() for backend in self.backends}
         }
+
+# One router per tier so latency and token metrics are recorded per tier; clients are shared per model
+chat_models = {}
+llm_routers = {}
+for tier, model_names in app.config['MODEL_TIERS'].items():
+    llm_routers[tier] = ModelRouter(
+        hedge_delay=app.config['HEDGE_DELAY'],
+        min_samples=app.config['HEDGE_MIN_SAMPLES']
+    )
+    for model_name in model_names:
+        if model_name not in chat_models:
+            chat_models[model_name] = ChatGroq(api_key=GROQ_API_KEY, model_name=model_name)
+        llm_routers[tier].register(model_name, chat_models[model_name])
+
+# Separate from the routers' executors, which candidate requests themselves submit to, and split by priority
+candidate_executors = {
+    'interactive': ThreadPoolExecutor(max_workers=int(os.getenv('CANDIDATE_WORKERS', 16))),
+    'bulk': ThreadPoolExecutor(max_workers=int(os.getenv('CANDIDATE_WORKERS', 16)))
+}
+
+def clean_meta_description(text):
+    """Strip explanation prefixes and surrounding quotes from a generated meta description"""
+    meta_description = text.strip()
     
-    banned_words_and_phrases = [
-        "Unlock", "Unleash", "Supercharge", "Leverage", "Empower", "Transform", "Transformative", 
-        "Revolutionize", "Amplify", "Maximize", "Elevate", "Disrupt", "Drive change", "Turbocharge", 
-        "Ignite", "Game-changer", "Secret weapon", "Arsenal", "Superpowers", "Lighthouse", "Magic", 
-        "Buzzword", "Puzzle", "Toolbox", "Journey", "Landscape", "Ecosystem", "Strategy", "Integrity",
-        "Savvy", "Cutting-edge", "Next-gen", "Innovative", "Powerful", "Essential", "Crucial", 
-        "Disruptive", "Seamless", "Limitless", "Scalable", "In today's world", "In conclusion", 
-        "Unlock the power of", "Shouting into the void", "Stop doing X. Start doing Y", 
-        "Where the magic happens", "Light up your funnel", "Revolutionize your", 
-        "Become a superstar", "A double-edged sword", "It's not about X. It's about Y", 
-        "Take your to the next level", "At the end of the day", "Soar to new heights", 
-        "Skyrocket your", "Crickets", "Stand out from the noise", "Thank you for it",
-        "It's important to", "It's vital that", "There's no denying that", 
-        "It goes without saying", "The reality is", "This article will help you", 
-        "We live in a world where", "This blog explores", "In this post, you'll discover"
+    # Remove common prefixes that might appear in the output
+    prefixes_to_remove = [
+        "Here is the meta description:", "Here's the meta description:",
+        "Meta description:", "Here is a meta description:",
+        "Here's a meta description:", "The meta description is:",
+        "Here is the revised meta description:", "Revised meta description:",
+        "Here's the revised meta description:"
     ]
     
-    # Get additional context from Perplexity
-    perplexity_context = search_perplexity(title, keyword)
+    for prefix in prefixes_to_remove:
+        if meta_description.lower().startswith(prefix.lower()):
+            meta_description = meta_description[len(prefix):].strip()
     
-    # Create prompt for meta description with strict character count requirements
-    prompt = f"""You are an SEO expert. Generate a UNIQUE {style['desc']} meta description that is COMPLETELY DIFFERENT from others:
+    # Remove any quotes that might be around the text
+    return meta_description.strip('"').strip("'").strip()
 
-Title: {title}
-Keyword: {keyword}
-Target Length: EXACTLY {target_length} characters
+def contains_banned_phrase(text, banned_phrases):
+    """Whether text uses a banned word or phrase, matched case-insensitively on word boundaries"""
+    return any(re.search(rf"\b{re.escape(phrase)}\b", text, re.IGNORECASE) for phrase in banned_phrases)
+
+# Generic endings appended in order until a short meta description reaches 120 characters;
+# together they add more than 120, so even an empty description ends up in range
+META_FILLER_SENTENCES = [
+    " Learn more about {keyword} today.",
+    " Explore practical tips, trusted advice and answers to common questions.",
+    " Find out what works best for you.",
+    " Get started now."
+]
+
+def fit_meta_length(meta_description, keyword):
+    """Force a meta description into 120-160 characters by truncating or extending it"""
+    if len(meta_description) < 120:
+        # Add generic endings if too short
+        for filler in META_FILLER_SENTENCES:
+            if len(meta_description) >= 120:
+                break
+            meta_description += filler.format(keyword=keyword)
+    # Truncate if too long
+    if len(meta_description) > 160:
+        meta_description = meta_description[:157] + '...'
+    return meta_description
+
+def select_meta_candidate(candidates, target_length, banned_phrases):
+    """Pick the banned-phrase-free candidate in 120-160 characters closest to target_length
+    
+    Falls back to the closest candidate when none qualify.
+    """
+    allowed = [c for c in candidates if not contains_banned_phrase(c, banned_phrases)] or candidates
+    in_range = [c for c in allowed if 120 <= len(c) <= 160]
+    return min(in_range or allowed, key=lambda c: abs(len(c) - target_length))
+
+def generate_meta_candidates(prompt, count):
+    """Request several length-bounded drafts concurrently, returning the cleaned non-empty ones"""
+    executor = candidate_executors[request_priority.get()]
+    futures = [submit_in_context(executor, llm_routers['draft'].invoke, prompt,
+                                 max_tokens=app.config['META_CANDIDATE_MAX_TOKENS'])
+               for _ in range(count)]
+    # Take whatever has arrived by the deadline
+    done, pending = wait(futures, timeout=remaining_budget())
+    for future in pending:
+        future.cancel()
+    candidates = []
+    errors = []
+    for future in [f for f in futures if f in done]:
+        try:
+            candidate = clean_meta_description(future.result().content)
+        except Exception as e:
+            errors.append(e)
+            continue
+        if candidate:
+            candidates.append(candidate)
+    if not candidates:
+        if errors:
+            raise errors[-1]
+        raise DeadlineExceeded("no meta description candidates arrived before the deadline")
+    return candidates
+
+# Prompt templates
+#
+# Every template starts with a static prefix (role, rules, banned list) that is
+# identical across requests, so provider-side prefix caching can reuse it. All
+# per-request values come last.
+
+BANNED_WORDS_AND_PHRASES = [
+    "Unlock", "Unleash", "Supercharge", "Leverage", "Empower", "Transform", "Transformative", 
+    "Revolutionize", "Amplify", "Maximize", "Elevate", "Disrupt", "Drive change", "Turbocharge", 
+    "Ignite", "Game-changer", "Secret weapon", "Arsenal", "Superpowers", "Lighthouse", "Magic", 
+    "Buzzword", "Puzzle", "Toolbox", "Journey", "Landscape", "Ecosystem", "Strategy", "Integrity",
+    "Savvy", "Cutting-edge", "Next-gen", "Innovative", "Powerful", "Essential", "Crucial", 
+    "Disruptive", "Seamless", "Limitless", "Scalable", "In today's world", "In conclusion", 
+    "Unlock the power of", "Shouting into the void", "Stop doing X. Start doing Y", 
+    "Where the magic happens", "Light up your funnel", "Revolutionize your", 
+    "Become a superstar", "A double-edged sword", "It's not about X. It's about Y", 
+    "Take your to the next level", "At the end of the day", "Soar to new heights", 
+    "Skyrocket your", "Crickets", "Stand out from the noise", "Thank you for it"
+]
+
+# Meta descriptions additionally ban filler openers
+META_BANNED_WORDS_AND_PHRASES = BANNED_WORDS_AND_PHRASES + [
+    "It's important to", "It's vital that", "There's no denying that", 
+    "It goes without saying", "The reality is", "This article will help you", 
+    "We live in a world where", "This blog explores", "In this post, you'll discover"
+]
+
+def compact_banned_list(phrases):
+    """Encode a banned list compactly for prompts
+    
+    Phrases that already contain another banned word (e.g. "Unlock the power of")
+    are dropped, case-insensitive duplicates removed and the rest joined with '|'.
+    """
+    kept = []
+    seen = set()
+    for phrase in phrases:
+        others = [p for p in phrases if p != phrase and len(p) < len(phrase)]
+        if phrase.lower() in seen or contains_banned_phrase(phrase, others):
+            continue
+        seen.add(phrase.lower())
+        kept.append(phrase)
+    return '|'.join(kept)
+
+def static_prefix(text):
+    """Escape literal braces in a template's static prefix"""
+    return text.replace('{', '{{').replace('}', '}}')
+
+META_DRAFT_TEMPLATE = PromptTemplate.from_template(static_prefix(f"""You are an SEO expert. Generate a UNIQUE meta description that is COMPLETELY DIFFERENT from others.
 
 STYLE REQUIREMENTS:
-- {style['approach']}
+- Follow the style given below
 - Never start the same way as other descriptions
 - Use unique sentence structures
 - Use fresh, original language
 
 STRICT RULES:
-1. MUST be BETWEEN 120-160 characters, with {target_length} as the ideal target
-2. Include '{keyword}' naturally but differently
+1. MUST be BETWEEN 120-160 characters, with the target length as the ideal
+2. Include the keyword naturally but differently
 3. Use active voice only
 4. NO duplicate words from title except the keyword
 5. Create a UNIQUE value proposition
-6. NEVER use any of these banned words and phrases: {', '.join(banned_words_and_phrases)}
+6. NEVER use any of these banned words and phrases (separated by |): {compact_banned_list(META_BANNED_WORDS_AND_PHRASES)}
 7. Count the characters PRECISELY - this is critical
 
+Output ONLY the meta description text. Do not include any explanations or character counts.
+""") + """
+Style: {style_desc} - {style_approach}
+Title: {title}
+Keyword: {keyword}
+Target Length: EXACTLY {target_length} characters
+
 Additional context from research:
-{perplexity_context}
+{perplexity_context}""")
+
+META_ADJUST_TEMPLATE = PromptTemplate.from_template("""Rewrite the meta description below to be between 120-160 characters while maintaining the same meaning and style.
+
+Output ONLY the revised meta description with no explanations, prefixes, or quotes.
+
+It is too {problem} at {char_count} characters, so {fix} it.
+Current description: {meta_description}""")
+
+CTA_TEMPLATE = PromptTemplate.from_template(static_prefix(f"""You are a conversion rate optimization expert. Generate a compelling call-to-action (CTA) for the title and keyword below.
+
+REQUIREMENTS:
+- Create a UNIQUE and COMPELLING call-to-action
+- Focus on creating urgency and value
+- Keep it concise (1-2 sentences maximum)
+- Include the keyword naturally
+- Use active voice and direct address
+- Be specific about the benefit/value
+- NEVER use any of these banned words and phrases (separated by |): {compact_banned_list(BANNED_WORDS_AND_PHRASES)}
+
+Output ONLY the CTA text. Do not include any explanations, prefixes, or quotes.
+""") + """
+Title: {title}
+Keyword: {keyword}""")
+
+# Appended to a draft or CTA prompt when regenerating a near-duplicate, after the static prefix
+REGENERATE_TEMPLATE = PromptTemplate.from_template("""
+
+This replaces a result too similar to others: "{avoid}"
+Write something clearly different from it, with a different opening, structure and wording.""")
+
+# Styles rotated through when regenerating near-duplicate meta descriptions
+REGENERATION_STYLES = [
+    {'desc': 'question-led', 'approach': 'Open with a question the searcher is asking'},
+    {'desc': 'specific', 'approach': 'Lead with a concrete detail, number or example'},
+    {'desc': 'action-first', 'approach': 'Start with what the reader will be able to do'}
+]
+
+PROMPT_TEMPLATES = {
+    'meta_draft': META_DRAFT_TEMPLATE,
+    'meta_adjust': META_ADJUST_TEMPLATE,
+    'cta': CTA_TEMPLATE,
+    'regenerate': REGENERATE_TEMPLATE
+}
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English prompts)"""
+    return (len(text) + 3) // 4
 
-Output ONLY the meta description text. Do not include any explanations or character counts."""
+def prompt_token_report():
+    """Estimated token counts per template: the cacheable static prefix and the whole template"""
+    report = {}
+    for name, template in PROMPT_TEMPLATES.items():
+        text = template.template
+        prefix = text[:text.index('{')] if '{' in text else text
+        report[name] = {
+            'static_prefix_tokens': estimate_tokens(prefix),
+            'template_tokens': estimate_tokens(text),
+            'variables': sorted(template.input_variables)
+        }
+    return report
+
+def generate_meta_description(title, keyword, target_length=150, style=None, avoid=None):
+    """Generate meta description using LLM with character count validation
     
-    # Generate meta description using Groq
-    response = groq_llm.invoke(prompt)
+    avoid is an earlier result the new description must clearly differ from.
+    """
+    if style is None:
+        style = {
+            'desc': 'compelling',
+            'approach': 'Focus on benefits and unique value'
+        }
     
-    # Clean up the response to remove any prefixes or explanations
-    meta_description = response.content.strip()
+    # Get additional context from Perplexity
+    perplexity_context = search_perplexity(title, keyword)
     
-    # Remove common prefixes that might appear in the output
-    prefixes_to_remove = [
-        "Here is the meta description:", "Here's the meta description:",
-        "Meta description:", "Here is a meta description:",
-        "Here's a meta description:", "The meta description is:",
-        "Here is the revised meta description:", "Revised meta description:",
-        "Here's the revised meta description:"
-    ]
+    # Create prompt for meta description with strict character count requirements
+    prompt = META_DRAFT_TEMPLATE.format(
+        style_desc=style['desc'],
+        style_approach=style['approach'],
+        title=title,
+        keyword=keyword,
+        target_length=target_length,
+        perplexity_context=perplexity_context
+    )
+    if avoid:
+        prompt += REGENERATE_TEMPLATE.format(avoid=avoid)
     
-    for prefix in prefixes_to_remove:
-        if meta_description.lower().startswith(prefix.lower()):
-            meta_description = meta_description[len(prefix):].strip()
+    try:
+        if app.config['META_CANDIDATE_MODE'] == 'parallel':
+            # One round-trip: pick the best of several concurrent drafts instead of re-prompting
+            candidates = generate_meta_candidates(prompt, app.config['META_CANDIDATES'])
+            meta_description = select_meta_candidate(candidates, target_length, META_BANNED_WORDS_AND_PHRASES)
+            return fit_meta_length(meta_description, keyword)
+        
+        # Generate meta description using Groq
+        response = llm_routers['draft'].invoke(prompt)
+    except DeadlineExceeded:
+        # Out of time without a draft: the title is the best we have
+        return fit_meta_length(f"{title}.", keyword)
     
-    # Remove any quotes that might be around the text
-    meta_description = meta_description.strip('"').strip("'").strip()
+    # Clean up the response to remove any prefixes or explanations
+    meta_description = clean_meta_description(response.content)
     
     # Validate and adjust character count
     attempts = 0
@@ -168,80 +963,51 @@ Output ONLY the meta description text. Do not include any explanations or charac
         if 120 <= char_count <= 160:
             return meta_description
         
+        # Not enough budget left for a rewrite, so fix the length locally
+        budget = remaining_budget()
+        if budget is not None and budget < app.config['ADJUST_MIN_BUDGET']:
+            break
+        
         # If too short, ask to expand
-        elif char_count < 120:
-            adjust_prompt = f"""The meta description is too short at {char_count} characters. 
-            Expand it to be between 120-160 characters while maintaining the same meaning and style:
-            
-            Current description: {meta_description}
+        if char_count < 120:
+            adjust_prompt = META_ADJUST_TEMPLATE.format(
+                problem='short', fix='expand', char_count=char_count, meta_description=meta_description)
             
-            Output ONLY the revised meta description with no explanations, prefixes, or quotes."""
-            
-            response = groq_llm.invoke(adjust_prompt)
+            try:
+                response = llm_routers['adjust'].invoke(adjust_prompt)
+            except DeadlineExceeded:
+                break
             meta_description = response.content.strip()
         
         # If too long, ask to trim
         elif char_count > 160:
-            adjust_prompt = f"""The meta description is too long at {char_count} characters. 
-            Trim it to be between 120-160 characters while maintaining the same meaning and style:
-            
-            Current description: {meta_description}
-            
-            Output ONLY the revised meta description with no explanations, prefixes, or quotes."""
+            adjust_prompt = META_ADJUST_TEMPLATE.format(
+                problem='long', fix='trim', char_count=char_count, meta_description=meta_description)
             
-            response = groq_llm.invoke(adjust_prompt)
+            try:
+                response = llm_routers['adjust'].invoke(adjust_prompt)
+            except DeadlineExceeded:
+                break
             meta_description = response.content.strip()
         
         attempts += 1
     
     # If still not within range after attempts, perform manual truncation or expansion
-    char_count = len(meta_description)
-    if char_count > 160:
-        meta_description = meta_description[:157] + '...'
-    elif char_count < 120:
-        # Add a generic ending if too short
-        meta_description += " Learn more about " + keyword + " today."
-        # Truncate if it became too long
-        if len(meta_description) > 160:
-            meta_description = meta_description[:157] + '...'
-    
-    return meta_description
+    return fit_meta_length(meta_description, keyword)
 
-def generate_cta_content(title, keyword):
-    """Generate CTA using LLM"""
-    banned_words_and_phrases = [
-        "Unlock", "Unleash", "Supercharge", "Leverage", "Empower", "Transform", "Transformative", 
-        "Revolutionize", "Amplify", "Maximize", "Elevate", "Disrupt", "Drive change", "Turbocharge", 
-        "Ignite", "Game-changer", "Secret weapon", "Arsenal", "Superpowers", "Lighthouse", "Magic", 
-        "Buzzword", "Puzzle", "Toolbox", "Journey", "Landscape", "Ecosystem", "Strategy", "Integrity",
-        "Savvy", "Cutting-edge", "Next-gen", "Innovative", "Powerful", "Essential", "Crucial", 
-        "Disruptive", "Seamless", "Limitless", "Scalable", "In today's world", "In conclusion", 
-        "Unlock the power of", "Shouting into the void", "Stop doing X. Start doing Y", 
-        "Where the magic happens", "Light up your funnel", "Revolutionize your", 
-        "Become a superstar", "A double-edged sword", "It's not about X. It's about Y", 
-        "Take your to the next level", "At the end of the day", "Soar to new heights", 
-        "Skyrocket your", "Crickets", "Stand out from the noise", "Thank you for it"
-    ]
-    
+def generate_cta_content(title, keyword, avoid=None):
+    """Generate CTA using LLM; avoid is an earlier result the new CTA must clearly differ from"""
     # Create prompt for CTA generation
-    prompt = f"""You are a conversion rate optimization expert. Generate a compelling call-to-action (CTA) for:
-
-Title: {title}
-Keyword: {keyword}
-
-REQUIREMENTS:
-- Create a UNIQUE and COMPELLING call-to-action
-- Focus on creating urgency and value
-- Keep it concise (1-2 sentences maximum)
-- Include '{keyword}' naturally
-- Use active voice and direct address
-- Be specific about the benefit/value
-- NEVER use any of these banned words and phrases: {', '.join(banned_words_and_phrases)}
-
-Output ONLY the CTA text. Do not include any explanations, prefixes, or quotes."""
+    prompt = CTA_TEMPLATE.format(title=title, keyword=keyword)
+    if avoid:
+        prompt += REGENERATE_TEMPLATE.format(avoid=avoid)
     
     # Generate CTA using Groq
-    response = groq_llm.invoke(prompt)
+    try:
+        response = llm_routers['cta'].invoke(prompt)
+    except DeadlineExceeded:
+        # Out of time: a plain CTA beats no CTA
+        return f"Explore {keyword} today."
     
     # Clean up the response to remove any prefixes or explanations
     cta = response.content.strip()
@@ -262,100 +1028,751 @@ Output ONLY the CTA text. Do not include any explanations, prefixes, or quotes."
     # Remove any quotes that might be around the text
     cta = cta.strip('"').strip("'").strip()
     
-    return cta
+    # An empty completion gets the same plain CTA as running out of time
+    return cta or f"Explore {keyword} today."
+
+def output_columns(generation_type):
+    """Columns of the results file for a generation type"""
+    if generation_type == 'meta':
+        return ['title', 'keyword', 'Meta Description 1', 'Meta Description 2', 'Meta Description 3']
+    return ['title', 'keyword', 'CTA 1', 'CTA 2', 'CTA 3']
+
+def open_input_batches(source, is_csv, batch_size):
+    """Return an iterator of title/keyword batches, or None if the columns are missing
+    
+    CSV sources may be a path or a file-like object such as the upload stream, so
+    rows are parsed as they are read without saving the upload first.
+    """
+    if is_csv:
+        try:
+            # Only the projected columns are parsed, as plain strings
+            return pd.read_csv(source, usecols=['title', 'keyword'], dtype=str, chunksize=batch_size)
+        except ValueError:
+            return None
+    
+    # Read only first 10 rows to check columns and create structure
+    df_sample = pd.read_excel(source, nrows=10)
+    if 'title' not in df_sample.columns or 'keyword' not in df_sample.columns:
+        return None
+    return iter_excel_batches(source, batch_size)
+
+def iter_excel_batches(file_path, batch_size):
+    """Yield the title/keyword columns of an Excel file in batches"""
+    # Excel doesn't support chunking directly, so we'll read in small batches
+    excel_file = pd.ExcelFile(file_path)
+    sheet_name = excel_file.sheet_names[0]  # Get first sheet
+    
+    # Get total rows
+    total_excel_rows = excel_file.book.sheet_by_name(sheet_name).nrows - 1  # Subtract header
+    
+    for start_row in range(1, total_excel_rows + 1, batch_size):  # Start from 1 to skip header
+        end_row = min(start_row + batch_size, total_excel_rows + 1)
+        # Skipping from row 1 keeps the header row for every batch
+        chunk = pd.read_excel(file_path, sheet_name=sheet_name, skiprows=range(1, start_row), nrows=end_row-start_row)
+        yield chunk[['title', 'keyword']]
+
+def new_memory_scheduler():
+    """A MemoryBudgetScheduler configured from the app settings"""
+    return MemoryBudgetScheduler(
+        app.config['MEMORY_BUDGET_MB'],
+        max_batch_size=app.config['MAX_BATCH_SIZE'],
+        max_concurrency=app.config['MAX_CONCURRENCY']
+    )
+
+def run_csv_batches(input_path, generation_type, output_path, scheduler, heartbeat=None):
+    """Generate content for a CSV in memory-budgeted batches, appending rows to output_path
+    
+    scheduler is shared across calls so its tuning carries over between shards;
+    heartbeat, if given, is called as each row completes.
+    """
+    total_rows = 0
+    
+    reader = pd.read_csv(input_path, iterator=True)
+    while True:
+        try:
+            chunk = reader.get_chunk(scheduler.batch_size)
+        except StopIteration:
+            break
+        process_chunk(chunk, generation_type, output_path, scheduler.concurrency, heartbeat)
+        total_rows += len(chunk)
+        scheduler.after_batch()
+    
+    return total_rows
+
+# Shared job store
+#
+# Each bulk upload becomes a job directory of CSV shards. Shards are published
+# while the upload is still being parsed and the job is sealed once the last one
+# is written. A shard is claimed by atomically renaming it to a name carrying a
+# unique claim token, so web processes, local pool processes and
+# `flask shard-worker` nodes sharing JOB_STORE_DIR can all pull from it safely.
+# The claimer touches its claim as each row completes; a claim that goes quiet for
+# SHARD_CLAIM_TIMEOUT is handed back, and the old claimer notices on its next
+# heartbeat that the claim is gone.
+
+SHARD_SUFFIXES = {'pending': '.csv', 'out': '.out.csv', 'failed': '.failed'}
+
+class ShardClaimLost(Exception):
+    """Raised when a worker's claim on a shard was released to another worker"""
+
+def shard_path(job_dir, index, state):
+    """Path of a shard file; state is 'pending', 'out' or 'failed'"""
+    return os.path.join(job_dir, f"shard_{index:05d}{SHARD_SUFFIXES[state]}")
+
+def claim_path(job_dir, index, token):
+    """Path of a shard while claimed by the worker holding token"""
+    return os.path.join(job_dir, f"shard_{index:05d}.{token}.claimed")
+
+def list_claims(job_dir):
+    """(index, path) of every currently claimed shard"""
+    try:
+        names = os.listdir(job_dir)
+    except FileNotFoundError:
+        return []
+    return [(int(name[6:11]), os.path.join(job_dir, name)) for name in names
+            if name.startswith('shard_') and name.endswith('.claimed')]
+
+def list_shards(job_dir, state):
+    """Sorted indices of the shards of a job currently in the given state"""
+    suffix = SHARD_SUFFIXES[state]
+    try:
+        names = os.listdir(job_dir)
+    except FileNotFoundError:
+        return []
+    # 'shard_00001.out.csv' also ends with '.csv', so match the whole name shape
+    return sorted(int(name[6:11]) for name in names
+                  if name.startswith('shard_') and name[11:] == suffix)
+
+def read_job_meta(job_dir):
+    """Return a job's metadata, or None if the job is not (or no longer) published"""
+    try:
+        with open(os.path.join(job_dir, 'job.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def write_job_meta(job_dir, meta):
+    """Atomically publish a job's metadata"""
+    tmp_path = os.path.join(job_dir, 'job.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(job_dir, 'job.json'))
+
+def start_shard_job(generation_type, job_id):
+    """Create an open job in the job store that shards can be added to"""
+    job_dir = os.path.join(app.config['JOB_STORE_DIR'], job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    write_job_meta(job_dir, {'generation_type': generation_type, 'sealed': False})
+    return job_dir
+
+def write_shards(job_dir, batches, generation_type):
+    """Publish each input batch as a shard as soon as it is parsed, then seal the job"""
+    shard_count = 0
+    total_rows = 0
+    for chunk in batches:
+        pending = shard_path(job_dir, shard_count, 'pending')
+        # Write under a temporary name so workers never claim a partial shard
+        chunk.to_csv(pending + '.tmp', index=False)
+        os.replace(pending + '.tmp', pending)
+        shard_count += 1
+        total_rows += len(chunk)
+    
+    meta = {'generation_type': generation_type, 'sealed': True, 'shards': shard_count, 'rows': total_rows}
+    write_job_meta(job_dir, meta)
+    return meta
 
-def process_file(file_path, generation_type):
-    """Process uploaded file and generate meta descriptions or CTAs with memory optimization"""
+def release_stale_claims(job_dir):
+    """Return shards claimed by a worker that died back to the pending pool"""
+    cutoff = time.time() - app.config['SHARD_CLAIM_TIMEOUT']
+    for index, claimed in list_claims(job_dir):
+        try:
+            if os.path.getmtime(claimed) < cutoff:
+                os.rename(claimed, shard_path(job_dir, index, 'pending'))
+        except FileNotFoundError:
+            continue
+
+def claim_next_shard(job_dir):
+    """Claim the next pending shard, returning (index, claim path) or None when nothing is pending"""
+    release_stale_claims(job_dir)
+    for index in list_shards(job_dir, 'pending'):
+        claimed = claim_path(job_dir, index, uuid.uuid4().hex[:12])
+        try:
+            os.rename(shard_path(job_dir, index, 'pending'), claimed)
+        except FileNotFoundError:
+            continue  # Already claimed by another worker
+        os.utime(claimed)  # Claim age is measured from now, not from shard creation
+        return index, claimed
+    return None
+
+def touch_claim(claimed):
+    """Heartbeat for a claim; raises ShardClaimLost if it was released to another worker"""
+    try:
+        os.utime(claimed)
+    except FileNotFoundError:
+        raise ShardClaimLost(claimed)
+
+def process_shard(job_dir, index, claimed, generation_type, scheduler):
+    """Generate content for a claimed shard and publish its output"""
+    tmp_output = claimed + '.out.tmp'
     try:
-        # Read the file - use chunksize for large files to reduce memory usage
-        if file_path.endswith('.csv'):
-            # Read only first 10 rows to check columns and create structure
-            df_sample = pd.read_csv(file_path, nrows=10)
+        with bulk_context(os.path.basename(job_dir)):
+            run_csv_batches(claimed, generation_type, tmp_output, scheduler,
+                            heartbeat=lambda: touch_claim(claimed))
+        # Publishing requires still holding the claim
+        touch_claim(claimed)
+        if not os.path.exists(tmp_output):
+            open(tmp_output, 'w').close()  # Empty shard
+        os.replace(tmp_output, shard_path(job_dir, index, 'out'))
+    except ShardClaimLost:
+        pass  # Another worker owns the shard now; leave its files alone
+    except Exception as e:
+        with open(shard_path(job_dir, index, 'failed'), 'w') as f:
+            f.write(str(e))
+    finally:
+        # Both paths carry this worker's claim token, so they are never another worker's files
+        for path in (tmp_output, claimed):
+            if os.path.exists(path):
+                os.remove(path)
+
+def drain_job(job_dir, follow=False):
+    """Process pending shards of a job; returns the number processed
+    
+    With follow=True keep waiting for new shards until the job is sealed, so
+    generation starts while the upload is still being parsed.
+    """
+    processed = 0
+    # One scheduler for every shard this call processes, so its tuning carries over
+    scheduler = new_memory_scheduler()
+    while True:
+        meta = read_job_meta(job_dir)
+        if meta is None:
+            return processed
+        
+        claim = claim_next_shard(job_dir)
+        if claim is not None:
+            index, claimed = claim
+            process_shard(job_dir, index, claimed, meta['generation_type'], scheduler)
+            processed += 1
+        elif follow and not meta['sealed']:
+            time.sleep(0.1)
         else:
-            # Read only first 10 rows to check columns and create structure
-            df_sample = pd.read_excel(file_path, nrows=10)
+            return processed
+
+def drain_jobs():
+    """Process pending shards of every job in the job store"""
+    store = app.config['JOB_STORE_DIR']
+    if not os.path.isdir(store):
+        return 0
+    return sum(drain_job(os.path.join(store, job_id)) for job_id in sorted(os.listdir(store)))
+
+def init_shard_process(memory_budget_mb, provider_slots):
+    """Give each pool process its share of the memory budget and of the bulk provider slots
+    
+    Pool processes only run bulk work, so they reserve no interactive slots.
+    """
+    global llm_scheduler
+    app.config['MEMORY_BUDGET_MB'] = memory_budget_mb
+    llm_scheduler = PriorityScheduler(slots=provider_slots, reserved_interactive=0,
+                                      max_bulk_pause=app.config['BULK_MAX_PAUSE'])
+
+def start_local_shard_workers(job_dir):
+    """Start draining a job in the background; returns the executor and its futures
+    
+    Uses a process pool when SHARD_WORKERS > 1, otherwise a single thread.
+    """
+    workers = app.config['SHARD_WORKERS']
+    # Slots the web process's scheduler would let bulk work use, divided between the pool processes
+    bulk_slots = llm_scheduler.slots - llm_scheduler.reserved_interactive
+    if workers <= 1:
+        executor = ThreadPoolExecutor(max_workers=1)
+    else:
+        # Spawn rather than fork: the web process is multi-threaded
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=init_shard_process,
+                                       initargs=(max(1, app.config['MEMORY_BUDGET_MB'] // workers),
+                                                 max(1, bulk_slots // workers)))
+    futures = [executor.submit(drain_job, job_dir, True) for _ in range(max(1, workers))]
+    return executor, futures
+
+def wait_for_job(job_dir, shard_count):
+    """Block until every shard has output, picking up shards abandoned by other workers"""
+    while True:
+        failed = list_shards(job_dir, 'failed')
+        if failed:
+            with open(shard_path(job_dir, failed[0], 'failed')) as f:
+                raise RuntimeError(f"shard {failed[0]} failed: {f.read()}")
+        
+        if len(list_shards(job_dir, 'out')) == shard_count:
+            return
+        
+        if not drain_job(job_dir):
+            time.sleep(app.config['SHARD_POLL_INTERVAL'])
+
+def read_shard_output(job_dir, index, columns):
+    """A shard's output as a DataFrame, or None for an empty shard"""
+    path = shard_path(job_dir, index, 'out')
+    if os.path.getsize(path) == 0:
+        return None
+    return pd.read_csv(path, header=None, names=columns, dtype=str, keep_default_na=False)
+
+def iter_shard_outputs(job_dir, shard_count, columns):
+    """Yield each shard's output as a DataFrame, in input order"""
+    for index in range(shard_count):
+        frame = read_shard_output(job_dir, index, columns)
+        if frame is not None:
+            yield frame
+
+def merge_shard_outputs(job_dir, shard_count, columns, output_path, output_format='csv'):
+    """Merge shard outputs in input order into a single results file, one shard at a time"""
+    if output_format in ('csv', 'csv.gz'):
+        # Shard outputs are already CSV, so copy bytes rather than re-parsing
+        opener = gzip.open if output_format == 'csv.gz' else open
+        with opener(output_path, 'wb') as out:
+            out.write(pd.DataFrame(columns=columns).to_csv(index=False).encode())
+            for index in range(shard_count):
+                with open(shard_path(job_dir, index, 'out'), 'rb') as shard:
+                    shutil.copyfileobj(shard, out)
+    
+    elif output_format == 'jsonl':
+        with open(output_path, 'w') as out:
+            for frame in iter_shard_outputs(job_dir, shard_count, columns):
+                # to_json already ends each shard's records with a newline
+                out.write(frame.to_json(orient='records', lines=True, force_ascii=False))
+    
+    elif output_format == 'parquet':
+        schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        with pyarrow.parquet.ParquetWriter(output_path, schema) as writer:
+            for frame in iter_shard_outputs(job_dir, shard_count, columns):
+                # One row group per shard
+                writer.write_table(pyarrow.Table.from_pandas(frame, schema=schema, preserve_index=False))
+    
+    elif output_format == 'xlsx':
+        # Write-only workbooks stream rows to disk instead of holding the sheet in memory
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('Results')
+        sheet.append(columns)
+        for frame in iter_shard_outputs(job_dir, shard_count, columns):
+            for row in frame.itertuples(index=False):
+                sheet.append(list(row))
+        workbook.save(output_path)
+
+# Near-duplicate detection
+#
+# Every generated cell is reduced to a MinHash signature of its character
+# shingles. Cells with identical signatures are collapsed first and every copy
+# after the first is flagged; cross-row candidates among the remaining distinct
+# signatures are found with LSH banding, and candidate pairs (plus the variants
+# within each row) are scored in one vectorized comparison.
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # 4 rows per band: pairs above ~0.5 similarity become candidates
+MINHASH_PRIME = (1 << 31) - 1
+SHINGLE_SIZE = 5
+LSH_MAX_BUCKET = 50  # Larger buckets pair each member with the bucket's first member only
+
+def shingle_hashes(text):
+    """31-bit hashes of a text's character shingles, after normalising case and spacing"""
+    text = ' '.join(str(text).lower().split())
+    if len(text) <= SHINGLE_SIZE:
+        return {hash(text) & MINHASH_PRIME}
+    return {hash(text[i:i + SHINGLE_SIZE]) & MINHASH_PRIME for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+def minhash_signatures(texts, block_shingles=50000):
+    """MinHash signatures for texts as a (len(texts), MINHASH_PERMUTATIONS) uint32 array"""
+    rng = np.random.default_rng(1)
+    a = rng.integers(1, MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+    signatures = np.empty((len(texts), MINHASH_PERMUTATIONS), dtype=np.uint32)
+    
+    start = 0
+    while start < len(texts):
+        # Gather a block of texts with at most block_shingles shingles between them
+        hashes, offsets, end = [], [], start
+        while end < len(texts) and (not offsets or len(hashes) < block_shingles):
+            offsets.append(len(hashes))
+            hashes.extend(shingle_hashes(texts[end]))
+            end += 1
+        
+        # (a * h + b) mod p for every shingle and permutation, then the minimum per text
+        values = (np.outer(np.array(hashes, dtype=np.uint64), a) + b) % MINHASH_PRIME
+        signatures[start:end] = np.minimum.reduceat(values, offsets, axis=0)
+        start = end
+    
+    return signatures
+
+def lsh_candidate_pairs(signatures, max_bucket=LSH_MAX_BUCKET):
+    """Pairs of signature rows sharing at least one LSH band, as an (n, 2) array with i < j
+    
+    Buckets of up to max_bucket members are fully paired; larger ones pair each
+    member with the first, so the pair count stays linear in the bucket size.
+    """
+    rows_per_band = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    weights = np.random.default_rng(2).integers(1, 1 << 62, rows_per_band, dtype=np.uint64)
+    pairs = []
+    for band in range(MINHASH_BANDS):
+        # Collapse each band to one key (uint64 arithmetic wraps, which is fine for bucketing)
+        chunk = signatures[:, band * rows_per_band:(band + 1) * rows_per_band].astype(np.uint64)
+        keys = (chunk * weights).sum(axis=1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        
+        # Pair each text with the others in its bucket
+        bucket_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        bucket_ends = np.r_[bucket_starts[1:], len(sorted_keys)]
+        shared = bucket_ends - bucket_starts > 1
+        for bucket_start, bucket_end in zip(bucket_starts[shared], bucket_ends[shared]):
+            members = np.sort(order[bucket_start:bucket_end])
+            if len(members) > max_bucket:
+                pairs.append(np.column_stack((np.full(len(members) - 1, members[0]), members[1:])))
+                continue
+            i, j = np.triu_indices(len(members), k=1)
+            pairs.append(np.column_stack((members[i], members[j])))
+    
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+def find_near_duplicates(texts, variants_per_row, threshold):
+    """Indices of texts to regenerate because they nearly duplicate an earlier text
+    
+    texts are row-major cells (variants_per_row per row). Texts with identical
+    signatures are flagged after their first occurrence. Within each row every
+    pair of variants is compared; across rows only LSH candidates among the
+    distinct signatures are.
+    """
+    if len(texts) < 2:
+        return set()
+    signatures = minhash_signatures(texts)
+    
+    # Collapse exact duplicates so a bucket of identical cells costs nothing in LSH
+    distinct, first_index, inverse = np.unique(signatures, axis=0, return_index=True, return_inverse=True)
+    flagged = set(np.flatnonzero(first_index[inverse.ravel()] != np.arange(len(texts))).tolist())
+    
+    rows = len(texts) // variants_per_row
+    i, j = np.triu_indices(variants_per_row, k=1)
+    base = (np.arange(rows) * variants_per_row)[:, None]
+    within_row = np.column_stack(((base + i).ravel(), (base + j).ravel()))
+    # LSH pairs are found between distinct signatures, then mapped to their first texts
+    across_rows = np.sort(first_index[lsh_candidate_pairs(distinct)], axis=1)
+    pairs = np.unique(np.concatenate([within_row, across_rows]), axis=0)
+    
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    # Keep the earlier text of each near-duplicate pair and regenerate the later one
+    return flagged | set(pairs[similarity >= threshold, 1].tolist())
+
+def load_shard_outputs(job_dir, shard_count, columns):
+    """Shard outputs as (shard index, DataFrame) pairs, skipping empty shards"""
+    frames = [(index, read_shard_output(job_dir, index, columns)) for index in range(shard_count)]
+    return [(index, frame) for index, frame in frames if frame is not None]
+
+def dedupe_shard_outputs(job_dir, shard_count, generation_type):
+    """Regenerate generated cells that nearly duplicate another cell in the results
+    
+    Returns the number of cells replaced. A cell whose regeneration fails keeps
+    its original text, so the optional pass never fails a finished job.
+    """
+    columns = output_columns(generation_type)
+    variant_columns = columns[2:]
+    frames = load_shard_outputs(job_dir, shard_count, columns)
+    if not frames or sum(len(frame) for _, frame in frames) > app.config['DEDUP_MAX_ROWS']:
+        return 0
+    
+    results = pd.concat([frame for _, frame in frames], ignore_index=True)
+    replaced = set()  # (row, column) of every cell given new text, across rounds
+    
+    def regenerate_cell(row, column, round_index):
+        """A replacement for a flagged cell, steered away from its current text"""
+        title, keyword = results.at[row, 'title'], results.at[row, 'keyword']
+        avoid = results.at[row, variant_columns[column]]
+        if generation_type == 'meta':
+            # Rotate styles by round and column so replacements in a row differ from each other too
+            style = REGENERATION_STYLES[(round_index + column) % len(REGENERATION_STYLES)]
+            return generate_meta_description(title, keyword, style=style, avoid=avoid)
+        return generate_cta_content(title, keyword, avoid=avoid)
+    
+    for round_index in range(app.config['DEDUP_ROUNDS']):
+        texts = results[variant_columns].to_numpy().ravel()
+        flagged = sorted(find_near_duplicates(texts, len(variant_columns), app.config['DEDUP_THRESHOLD']))
+        if not flagged:
+            break
+        
+        # Flagged columns grouped by row, so each row's regenerations share one deadline
+        flagged_columns = {}
+        for position in flagged:
+            row, column = divmod(position, len(variant_columns))
+            flagged_columns.setdefault(row, []).append(column)
+        
+        def regenerate(row, columns):
+            """Replacement text per flagged column, or None where regeneration failed"""
+            texts = []
+            with deadline_context(app.config['BULK_ROW_DEADLINE']):
+                llm_scheduler.bulk_checkpoint()
+                for column in columns:
+                    try:
+                        texts.append(regenerate_cell(row, column, round_index))
+                    except Exception as e:
+                        app.logger.warning("Keeping near-duplicate cell (%s, %s): %s", row, column, e)
+                        texts.append(None)
+            return texts
+        
+        with bulk_context(os.path.basename(job_dir)), \
+                ThreadPoolExecutor(max_workers=app.config['MAX_CONCURRENCY']) as executor:
+            futures = {row: submit_in_context(executor, regenerate, row, columns)
+                       for row, columns in flagged_columns.items()}
+            for row, future in futures.items():
+                for column, text in zip(flagged_columns[row], future.result()):
+                    if text and text != results.at[row, variant_columns[column]]:
+                        results.at[row, variant_columns[column]] = text
+                        replaced.add((row, column))
+    
+    # Write the updated cells back to their shards
+    offset = 0
+    for index, frame in frames:
+        results.iloc[offset:offset + len(frame)].to_csv(shard_path(job_dir, index, 'out'), header=False, index=False)
+        offset += len(frame)
+    
+    return len(replaced)
+
+def process_file(source, generation_type, is_csv=True, output_format='csv'):
+    """Process uploaded file and generate meta descriptions or CTAs with memory optimization
+    
+    source is a path, or for CSV a file-like object such as the upload stream.
+    output_format is one of OUTPUT_FORMATS.
+    """
+    job_dir = None
+    executor = None
+    try:
+        batches = open_input_batches(source, is_csv, app.config['SHARD_SIZE'])
         
         # Check required columns
-        if 'title' not in df_sample.columns or 'keyword' not in df_sample.columns:
+        if batches is None:
             return None, "Error: File must contain 'title' and 'keyword' columns."
         
+        if output_format not in OUTPUT_FORMATS:
+            return None, f"Error: Unsupported output format '{output_format}'."
+        if output_format == 'parquet' and pyarrow is None:
+            return None, "Error: Parquet output requires pyarrow to be installed."
+        
         # Create directory for output if it doesn't exist
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
         
         # Create a unique filename
-        filename = f"{generation_type}_results_{uuid.uuid4().hex[:8]}.csv"
+        job_id = uuid.uuid4().hex[:8]
+        filename = f"{generation_type}_results_{job_id}{OUTPUT_FORMATS[output_format][0]}"
         output_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
-        # Process in small batches to reduce memory usage
-        # First create the output file with headers
-        if generation_type == 'meta':
-            columns = ['title', 'keyword', 'Meta Description 1', 'Meta Description 2', 'Meta Description 3']
-        else:
-            columns = ['title', 'keyword', 'CTA 1', 'CTA 2', 'CTA 3']
-            
-        # Create empty output file with headers
-        pd.DataFrame(columns=columns).to_csv(output_path, index=False)
-        
-        # Process in small batches
-        batch_size = 3  # Very small batch size for strict memory constraints
-        total_rows = 0
-        
-        # Process CSV or Excel in chunks
-        if file_path.endswith('.csv'):
-            for chunk in pd.read_csv(file_path, chunksize=batch_size):
-                process_chunk(chunk, generation_type, output_path)
-                total_rows += len(chunk)
-        else:
-            # Excel doesn't support chunking directly, so we'll read in small batches
-            excel_file = pd.ExcelFile(file_path)
-            sheet_name = excel_file.sheet_names[0]  # Get first sheet
-            
-            # Get total rows
-            total_excel_rows = excel_file.book.sheet_by_name(sheet_name).nrows - 1  # Subtract header
-            
-            # Process in batches
-            for start_row in range(1, total_excel_rows + 1, batch_size):  # Start from 1 to skip header
-                end_row = min(start_row + batch_size, total_excel_rows + 1)
-                chunk = pd.read_excel(file_path, sheet_name=sheet_name, skiprows=range(1, start_row), nrows=end_row-start_row)
-                
-                # Add headers if this is the first chunk
-                if start_row == 1:
-                    chunk.columns = df_sample.columns
-                    
-                process_chunk(chunk, generation_type, output_path)
-                total_rows += len(chunk)
-        
-        return filename, f"Successfully processed {total_rows} rows."
+        # Shards are generated here and on any shard workers while the input is still being split
+        job_dir = start_shard_job(generation_type, job_id)
+        executor, futures = start_local_shard_workers(job_dir)
+        meta = write_shards(job_dir, batches, generation_type)
+        for future in futures:
+            future.result()
+        
+        wait_for_job(job_dir, meta['shards'])
+        
+        # Diversify near-identical copy across the whole results set before merging
+        regenerated = 0
+        if app.config['DEDUP_ENABLED']:
+            regenerated = dedupe_shard_outputs(job_dir, meta['shards'], generation_type)
+        
+        merge_shard_outputs(job_dir, meta['shards'], output_columns(generation_type), output_path, output_format)
+        
+        message = f"Successfully processed {meta['rows']} rows."
+        if regenerated:
+            message += f" Regenerated {regenerated} near-duplicate variants."
+        return filename, message
     except Exception as e:
         return None, f"Error processing file: {str(e)}"
+    finally:
+        # Removing the job also stops any local workers still following it
+        if job_dir:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        if executor:
+            executor.shutdown(wait=True)
+
+def process_upload(file, generation_type, output_format='csv'):
+    """Run bulk generation for an uploaded file, streaming CSVs straight from the request"""
+    filename = secure_filename(file.filename)
+    if filename.lower().endswith('.csv'):
+        return process_file(file.stream, generation_type, is_csv=True, output_format=output_format)
+    
+    # Excel workbooks need random access, so save them first
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    file.save(file_path)
+    return process_file(file_path, generation_type, is_csv=False, output_format=output_format)
 
-def process_chunk(chunk, generation_type, output_path):
-    """Process a small chunk of data to reduce memory usage"""
+def process_chunk(chunk, generation_type, output_path, concurrency=1, heartbeat=None):
+    """Process a small chunk of data, generating variants concurrently
+    
+    heartbeat, if given, is called as each row completes; if it raises, rows not
+    yet started are cancelled and the error propagates.
+    """
     # Create a result dataframe for this chunk
     result_chunk = chunk.copy()
     
-    # Process each row in the chunk
-    for idx, row in result_chunk.iterrows():
+    if generation_type == 'meta':
+        generate, column_prefix = generate_meta_description, 'Meta Description'
+    else:
+        generate, column_prefix = generate_cta_content, 'CTA'
+    
+    # One task per row, so the row's three variants share its deadline
+    tasks = [(idx, row['title'], row['keyword']) for idx, row in result_chunk.iterrows()]
+    
+    def run_task(title, keyword):
+        with deadline_context(app.config['BULK_ROW_DEADLINE']):
+            # Row boundary: yield to interactive requests before starting new work
+            llm_scheduler.bulk_checkpoint()
+            return [generate(title, keyword) for _ in range(3)]
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {submit_in_context(executor, run_task, title, keyword): idx for idx, title, keyword in tasks}
+        try:
+            # Rows are collected as they finish, so the heartbeat fires at least once per row
+            for future in as_completed(futures):
+                for i, variant in enumerate(future.result(), start=1):
+                    result_chunk.at[futures[future], f'{column_prefix} {i}'] = variant
+                if heartbeat:
+                    heartbeat()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    
+    # Append to the CSV file without loading the whole file into memory
+    result_chunk.to_csv(output_path, mode='a', header=False, index=False)
+
+# Bulk API helpers
+#
+# The API takes JSON arrays or NDJSON of {title, keyword, type} rows and emits one
+# NDJSON result per row as it completes. Results carry the row's input index
+# because rows finish out of order.
+
+API_GENERATORS = {
+    'meta': lambda title, keyword: generate_meta_description(title, keyword),
+    'cta': lambda title, keyword: generate_cta_content(title, keyword)
+}
+
+def iter_api_rows(stream, is_ndjson):
+    """Yield API rows from a request body; NDJSON lines are yielded raw and parsed by the worker"""
+    if is_ndjson:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield line
+        return
+    
+    rows = json.load(stream)
+    if not isinstance(rows, list):
+        raise ValueError("JSON body must be an array of rows")
+    yield from rows
+
+def generate_api_row(index, row):
+    """Generate three variants for a single API row"""
+    try:
+        if isinstance(row, (str, bytes)):
+            row = json.loads(row)
         title = row['title']
         keyword = row['keyword']
+        generation_type = row.get('type', 'meta')
+        if generation_type not in API_GENERATORS:
+            raise ValueError(f"unknown type '{generation_type}'")
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return {'index': index, 'error': f"Invalid row: {e}"}
+    
+    try:
+        generate = API_GENERATORS[generation_type]
+        results = [generate(title, keyword) for _ in range(3)]
+    except Exception as e:
+        return {'index': index, 'title': title, 'keyword': keyword, 'type': generation_type,
+                'error': str(e)}
+    
+    return {'index': index, 'title': title, 'keyword': keyword, 'type': generation_type,
+            'results': results}
+
+def run_bulk_api_row(job_id, index, row):
+    """Generate an API row as bulk work, yielding to interactive requests first"""
+    with bulk_context(job_id), deadline_context(app.config['BULK_ROW_DEADLINE']):
+        llm_scheduler.bulk_checkpoint()
+        return generate_api_row(index, row)
+
+def iter_api_results(rows, concurrency, job_id=None):
+    """Yield row results as they complete, keeping at most `concurrency` rows in flight"""
+    job_id = job_id or uuid.uuid4().hex
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        pending = set()
+        for index, row in enumerate(rows):
+            pending.add(executor.submit(run_bulk_api_row, job_id, index, row))
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
         
-        if generation_type == 'meta':
-            # Generate meta descriptions one at a time to reduce memory usage
-            for i in range(1, 4):
-                meta = generate_meta_description(title, keyword)
-                result_chunk.at[idx, f'Meta Description {i}'] = meta
-                # Force garbage collection to free memory
-                gc.collect()
-        else:
-            # Generate CTAs one at a time
-            for i in range(1, 4):
-                cta = generate_cta_content(title, keyword)
-                result_chunk.at[idx, f'CTA {i}'] = cta
-                # Force garbage collection to free memory
-                gc.collect()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def api_job_path(job_id, suffix):
+    """Path of an async API job file; job files live in UPLOAD_FOLDER so any node can serve them"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'api_jobs', f"{job_id}{suffix}")
+
+def api_job_owner():
+    """Identifies the process running an async job"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def write_api_job_status(job_id, status):
+    status = dict(status, owner=api_job_owner(), heartbeat=time.time())
+    tmp_path = api_job_path(job_id, f'.json.{uuid.uuid4().hex[:8]}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, api_job_path(job_id, '.json'))
+
+def read_api_job_status(job_id):
+    """Status of an async job, or None; a running job whose owner stopped heartbeating is reported as failed"""
+    status_path = api_job_path(job_id, '.json')
+    if not os.path.exists(status_path):
+        return None
+    with open(status_path) as f:
+        status = json.load(f)
+    if status['status'] == 'running' and time.time() - status.get('heartbeat', 0) > app.config['API_JOB_STALE_AFTER']:
+        status['status'] = 'failed'
+        status['error'] = f"Job owner {status.get('owner', 'unknown')} stopped responding"
+    return status
+
+def run_api_job(job_id, is_ndjson):
+    """Generate results for a saved async API job body"""
+    input_path = api_job_path(job_id, '.input')
+    state = {'status': 'running', 'completed': 0}
+    lock = threading.Lock()
+    done = threading.Event()
     
-    # Append to the CSV file without loading the whole file into memory
-    result_chunk.to_csv(output_path, mode='a', header=False, index=False)
+    def publish(**changes):
+        with lock:
+            state.update(changes)
+            write_api_job_status(job_id, dict(state, job_id=job_id))
+    
+    def heartbeat():
+        # Keeps the status fresh while a slow row is still generating
+        while not done.wait(app.config['API_JOB_HEARTBEAT']):
+            publish()
+    
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        with open(input_path, 'rb') as body, open(api_job_path(job_id, '.ndjson'), 'w') as out:
+            for result in iter_api_results(iter_api_rows(body, is_ndjson), app.config['MAX_CONCURRENCY'], job_id):
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+                publish(completed=state['completed'] + 1)
+        done.set()
+        publish(status='complete')
+    except Exception as e:
+        done.set()
+        publish(status='failed', error=str(e))
+    finally:
+        done.set()
+        if os.path.exists(input_path):
+            os.remove(input_path)
 
 # Routes
 @app.route('/')
@@ -370,10 +1787,11 @@ def generate_meta():
             title = request.form['title']
             keyword = request.form['keyword']
             
-            # Generate 3 different meta descriptions
-            meta1 = generate_meta_description(title, keyword)
-            meta2 = generate_meta_description(title, keyword)
-            meta3 = generate_meta_description(title, keyword)
+            # Generate 3 different meta descriptions, ahead of any bulk work
+            with llm_scheduler.interactive(), deadline_context(app.config['REQUEST_DEADLINE']):
+                meta1 = generate_meta_description(title, keyword)
+                meta2 = generate_meta_description(title, keyword)
+                meta3 = generate_meta_description(title, keyword)
             
             return render_template('meta_results.html', title=title, keyword=keyword, 
                                   meta1=meta1, meta2=meta2, meta3=meta3)
@@ -386,12 +1804,8 @@ def generate_meta():
                 return redirect(request.url)
             
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                
                 # Process file
-                output_file, message = process_file(file_path, 'meta')
+                output_file, message = process_upload(file, 'meta', request.form.get('output_format', 'csv'))
                 if message and "Error" in message:
                     flash(message)
                     return redirect(request.url)
@@ -414,10 +1828,11 @@ def generate_cta():
             title = request.form['title']
             keyword = request.form['keyword']
             
-            # Generate 3 different CTAs
-            cta1 = generate_cta_content(title, keyword)
-            cta2 = generate_cta_content(title, keyword)
-            cta3 = generate_cta_content(title, keyword)
+            # Generate 3 different CTAs, ahead of any bulk work
+            with llm_scheduler.interactive(), deadline_context(app.config['REQUEST_DEADLINE']):
+                cta1 = generate_cta_content(title, keyword)
+                cta2 = generate_cta_content(title, keyword)
+                cta3 = generate_cta_content(title, keyword)
             
             return render_template('cta_results.html', title=title, keyword=keyword, 
                                   cta1=cta1, cta2=cta2, cta3=cta3)
@@ -430,12 +1845,8 @@ def generate_cta():
                 return redirect(request.url)
             
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                
                 # Process file
-                output_file, message = process_file(file_path, 'cta')
+                output_file, message = process_upload(file, 'cta', request.form.get('output_format', 'csv'))
                 if message and "Error" in message:
                     flash(message)
                     return redirect(request.url)
@@ -450,25 +1861,116 @@ def generate_cta():
     
     return render_template('generate_cta.html')
 
+# Machine-oriented bulk API
+@app.route('/api/generate', methods=['POST'])
+def api_generate():
+    """Generate content for JSON or NDJSON rows, streaming NDJSON results or starting an async job"""
+    is_ndjson = request.mimetype in ('application/x-ndjson', 'application/ndjson')
+    if not is_ndjson and request.mimetype != 'application/json':
+        return {'error': 'Content-Type must be application/json or application/x-ndjson'}, 415
+    
+    if request.args.get('mode') == 'async':
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.dirname(api_job_path(job_id, '')), exist_ok=True)
+        with open(api_job_path(job_id, '.input'), 'wb') as f:
+            shutil.copyfileobj(request.stream, f)
+        write_api_job_status(job_id, {'job_id': job_id, 'status': 'running', 'completed': 0})
+        threading.Thread(target=run_api_job, args=(job_id, is_ndjson), daemon=True).start()
+        return {'job_id': job_id, 'status_url': url_for('api_job_status', job_id=job_id),
+                'results_url': url_for('api_job_results', job_id=job_id)}, 202
+    
+    def stream_results():
+        try:
+            rows = iter_api_rows(request.stream, is_ndjson)
+            for result in iter_api_results(rows, app.config['MAX_CONCURRENCY']):
+                yield json.dumps(result) + '\n'
+        except ValueError as e:
+            yield json.dumps({'error': f"Invalid request body: {e}"}) + '\n'
+    
+    return Response(stream_with_context(stream_results()), mimetype='application/x-ndjson')
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    status = read_api_job_status(secure_filename(job_id))
+    if status is None:
+        return {'error': 'Job not found'}, 404
+    return status, 200
+
+@app.route('/api/jobs/<job_id>/results')
+def api_job_results(job_id):
+    """Results completed so far, as NDJSON"""
+    results_path = api_job_path(secure_filename(job_id), '.ndjson')
+    if not os.path.exists(results_path):
+        return {'error': 'Job not found'}, 404
+    return send_file(os.path.abspath(results_path), mimetype='application/x-ndjson')
+
+def gzip_sibling(file_path):
+    """Return a gzip-compressed copy of a results file, compressing it on first use"""
+    gz_path = file_path + '.gz'
+    if not os.path.exists(gz_path) or os.path.getmtime(gz_path) < os.path.getmtime(file_path):
+        tmp_path = f"{gz_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(file_path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, gz_path)
+    return gz_path
+
 # Dedicated download route
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
+        filename = secure_filename(filename)
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         if not os.path.exists(file_path):
             flash("File not found. Please try again.")
             return redirect(url_for('index'))
-            
-        return send_file(
-            file_path,
+        
+        mimetype = 'application/octet-stream'
+        for extension, format_mimetype in OUTPUT_FORMATS.values():
+            if filename.endswith(extension):
+                mimetype = format_mimetype
+        
+        # Text formats are sent gzip-encoded to clients that accept it; binary formats are already compact
+        compressible = filename.endswith(('.csv', '.jsonl'))
+        use_gzip = compressible and request.accept_encodings['gzip'] > 0
+        
+        # send_file handles Range requests, ETag and If-None-Match for whichever representation is sent
+        response = send_file(
+            os.path.abspath(gzip_sibling(file_path) if use_gzip else file_path),
             as_attachment=True,
             download_name=filename,
-            mimetype='text/csv'
+            mimetype=mimetype,
+            conditional=True,
+            etag=True
         )
+        if compressible:
+            response.vary.add('Accept-Encoding')
+        if use_gzip:
+            response.content_encoding = 'gzip'
+        return response
     except Exception as e:
         flash(f"Download error: {str(e)}")
         return redirect(url_for('index'))
 
+@app.cli.command('shard-worker')
+def shard_worker_command():
+    """Pull and process shards from the shared job store until stopped"""
+    while True:
+        try:
+            processed = drain_jobs()
+        except Exception:
+            # A job removed mid-shard must not take the worker down
+            app.logger.exception("Shard worker failed to drain the job store")
+            processed = 0
+        if not processed:
+            time.sleep(app.config['SHARD_POLL_INTERVAL'])
+
+@app.cli.command('prompt-report')
+def prompt_report_command():
+    """Print estimated token counts for each prompt template"""
+    for name, counts in prompt_token_report().items():
+        print(f"{name}: static prefix ~{counts['static_prefix_tokens']} tokens, "
+              f"template ~{counts['template_tokens']} tokens, variables: {', '.join(counts['variables'])}")
+
 # Ensure upload directory exists at startup
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
@@ -495,5 +1997,11 @@ def health_check():
     return {
         'status': 'healthy',
         'memory': memory_info,
+        'dependencies': {
+            'perplexity': perplexity_breaker.stats()
+        },
+        'models': {tier: router.stats() for tier, router in llm_routers.items()},
+        'scheduler': llm_scheduler.stats(),
+        'prompts': prompt_token_report(),
         'environment': 'railway'
     }, 200
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# app builds its Groq clients at import time; no calls are made in tests
+os.environ.setdefault('GROQ_API_KEY', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
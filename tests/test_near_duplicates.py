@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def test_identical_cells_are_flagged_after_the_first():
+    texts = np.array(["Find the best running shoes for every distance and budget."] * 15000, dtype=object)
+    flagged = app.find_near_duplicates(texts, 3, 0.7)
+    assert flagged == set(range(1, 15000))
+
+
+def test_large_near_duplicate_bucket_stays_linear():
+    texts = [f"Find the best running shoes for every distance and budget, option {i}." for i in range(3000)]
+    pairs = app.lsh_candidate_pairs(app.minhash_signatures(texts))
+    assert len(pairs) < len(texts) * app.MINHASH_BANDS
+    flagged = app.find_near_duplicates(np.array(texts, dtype=object), 3, 0.7)
+    assert 0 not in flagged
+    assert len(flagged) > 2000
+
+
+def test_distinct_texts_are_kept():
+    texts = np.array([
+        "Compare trail running shoes by grip, cushioning and weight.",
+        "Plan a week of healthy breakfasts with simple pantry staples.",
+        "Learn how compound interest grows a small monthly saving.",
+        "Compare trail running shoes by grip, cushioning and weight!",
+        "Repot houseplants in spring without damaging their roots.",
+        "Choose a beginner telescope for watching planets at home.",
+    ], dtype=object)
+    assert app.find_near_duplicates(texts, 3, 0.7) == {3}
+
+
+def test_failed_regeneration_keeps_the_original_text(tmp_path, monkeypatch):
+    job_dir = str(tmp_path)
+    columns = app.output_columns('cta')
+    rows = pd.DataFrame([['Title', 'shoes', 'Shop shoes now.', 'Shop shoes now.', 'Shop shoes now.']] * 2,
+                        columns=columns)
+    rows.to_csv(app.shard_path(job_dir, 0, 'out'), header=False, index=False)
+    calls = []
+
+    def generate_cta_content(title, keyword, avoid=None):
+        calls.append(avoid)
+        if len(calls) % 2:
+            raise ValueError("provider error")
+        return f"Compare {keyword} option {len(calls)}."
+
+    monkeypatch.setattr(app, 'generate_cta_content', generate_cta_content)
+    monkeypatch.setitem(app.app.config, 'DEDUP_ROUNDS', 2)
+    replaced = app.dedupe_shard_outputs(job_dir, 1, 'cta')
+
+    result = pd.read_csv(app.shard_path(job_dir, 0, 'out'), header=None, names=columns, dtype=str)
+    cells = result[columns[2:]].to_numpy().ravel().tolist()
+    assert replaced == sum(cell != 'Shop shoes now.' for cell in cells)
+    assert 0 < replaced < len(cells) - 1